@@ -1,17 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import functools
 import os
 import pathlib
 import sys
 
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 import seaborn as sb
 # Import base utils
 import torch
 from torch import nn
-from functorch import vmap, jacfwd, jacrev
+from torch.func import vmap, jacfwd, jacrev, jvp
 
 # To avoid Type 3 fonts for submission https://tex.stackexchange.com/questions/18687/how-to-generate-pdf-without-any-type3-fonts
 # https://jwalton.info/Matplotlib-latex-PGF/
@@ -45,7 +45,6 @@ from learn_KKL.luenberger_observer import LuenbergerObserver
 import pytorch_lightning as pl
 from pytorch_lightning.callbacks import ModelCheckpoint
 from pytorch_lightning.loggers import TensorBoardLogger
-from sklearn.model_selection import train_test_split
 import torch.optim as optim
 
 if __name__ == "__main__":
@@ -90,7 +89,10 @@ if __name__ == "__main__":
         # Generate training data and validation data
         data = observer.generate_data_svl(x_limits, num_samples, method="LHS",
                                           k=10)
-        data, val_data = train_test_split(data, test_size=0.3, shuffle=True)
+        # Shuffle and split 30% of data for validation
+        perm = torch.randperm(len(data))
+        n_val = int(np.ceil(0.3 * len(data)))
+        data, val_data = data[perm[n_val:]], data[perm[:n_val]]
 
         ##########################################################################
         # Setup learner ##########################################################
@@ -137,13 +139,14 @@ if __name__ == "__main__":
 
         # Define logger and checkpointing
         logger = TensorBoardLogger(
-            save_dir=learner_T.results_folder + '/tb_logs')
+            save_dir=learner_T.results_folder + '/tb_logs', flush_secs=120,
+            default_hp_metric=False)
         checkpoint_callback = ModelCheckpoint(monitor='val_loss')
         trainer = pl.Trainer(
             callbacks=[stopper, checkpoint_callback],
             **trainer_options,
             logger=logger,
-            log_every_n_steps=1,
+            log_every_n_steps=50,
             check_val_every_n_epoch=3
         )
 
@@ -192,13 +195,14 @@ if __name__ == "__main__":
 
         # Define logger and checkpointing
         logger = TensorBoardLogger(
-            save_dir=learner_T_star.results_folder + "/tb_logs")
+            save_dir=learner_T_star.results_folder + "/tb_logs",
+            flush_secs=120, default_hp_metric=False)
         checkpoint_callback = ModelCheckpoint(monitor="val_loss")
         trainer = pl.Trainer(
             callbacks=[stopper, checkpoint_callback],
             **trainer_options,
             logger=logger,
-            log_every_n_steps=1,
+            log_every_n_steps=50,
             check_val_every_n_epoch=3,
         )
 
@@ -228,9 +232,15 @@ if __name__ == "__main__":
     # Generate plots #########################################################
     ##########################################################################
 
+    # Only results of T_star are saved here (those of T are saved after
+    # training T); a loaded learner has no new checkpoint to restore
+    if TRAIN:
+        checkpoint_path = checkpoint_callback.best_model_path
+    else:
+        checkpoint_path = None
     learner_T_star.save_results(
         limits=x_limits, nb_trajs=10, tsim=(0, 50), dt=1e-2,
-        checkpoint_path=checkpoint_callback.best_model_path)
+        checkpoint_path=checkpoint_path)
 
     # Plot heatmaps of transformations and their gradients
     if gradient_plots:
@@ -247,17 +257,21 @@ if __name__ == "__main__":
                 # Zero initial value
                 if z_0 is None:
                     z_0 = torch.zeros((1, self.dim_z))
+                # Transposed observer matrices, constant over the simulation
+                D_T = self.D.t().contiguous()
+                F_T = self.F.t().contiguous()
 
                 def dydt(t, z: torch.tensor):
                     xhat = self.decoder(z)
-                    zhat = self.encoder(xhat)
-                    dTdx = vmap(jacfwd(self.encoder))(xhat)
-                    lhs = torch.einsum("ijk,ik->ij", dTdx, self.f(xhat))
-                    rhs = torch.matmul(
-                        zhat, self.D.t()) + torch.matmul(self.h(xhat),
-                                                         self.F.t())
-                    z_dot = torch.matmul(z, self.D.t()) + torch.matmul(
-                        measurement(t), self.F.t()) + (lhs - rhs)
+                    fx = self.f(xhat)
+                    hx = self.h(xhat)
+                    # dT/dx(xhat) f(xhat) as a single Jacobian-vector
+                    # product, which also returns zhat = T(xhat)
+                    zhat, lhs = jvp(self.encoder, (xhat,), (fx,))
+                    # D z + F y + dT/dx f - (D zhat + F h) with one matmul
+                    # per observer matrix
+                    z_dot = torch.matmul(z - zhat, D_T) + torch.matmul(
+                        measurement(t) - hx, F_T) + lhs
                     # test = (torch.matmul(self.D, z.t()) + torch.matmul(
                     #     self.F, measurement(t).t()) + torch.matmul(
                     #     torch.squeeze(dTdx), self.f(xhat).t()) -
@@ -284,64 +298,58 @@ if __name__ == "__main__":
         if save:
             # Gradient heatmap computed numerically
             # Need true regular grid in x, i.e. num_per_dim ** dim_x = num_samples!
-            mesh = learner_T_star.model.generate_data_svl(x_limits, 10000,
-                                                   method='uniform')
+            mesh = learner_T_star.model.generate_data_svl(
+                x_limits, 10000, method='uniform')
             x = mesh[:, learner_T_star.x_idx_in]
             z = mesh[:, learner_T_star.z_idx_in]
             path = os.path.join(learner_T_star.results_folder, 'gradients')
             os.makedirs(path, exist_ok=False)
-            file = pd.DataFrame(mesh)
-            file.to_csv(os.path.join(path, f'mesh.csv'), header=False)
+            torch.save(mesh, os.path.join(path, 'mesh.pt'))
             T = learner_T_star.model.encoder(x)
             Tstar = learner_T_star.model.decoder(z)
 
-            # Gradient heatmap of NN model
-            dTdx = vmap(jacfwd(learner_T_star.model.encoder))(x)
+            # Gradient heatmap of NN model: T maps R^dim_x -> R^dim_z with
+            # dim_z > dim_x so forward mode needs fewer passes, T* the
+            # opposite so reverse mode. Chunk the mesh to bound peak memory.
+            # The torch.func transforms ignore an outer no_grad, which only
+            # avoids recording the surrounding ops.
+            batch_jacobian = functools.partial(vmap, chunk_size=1024)
+            with torch.no_grad():
+                dTdx = batch_jacobian(jacfwd(learner_T_star.model.encoder))(x)
+                # Compute dTstar_dz over grid
+                dTstar_dz = batch_jacobian(
+                    jacrev(learner_T_star.model.decoder))(z)
             dTdx = dTdx[:, :, : learner_T_star.model.dim_x]
             idx_max = torch.argmax(torch.linalg.matrix_norm(dTdx, ord=2))
             Tmax = dTdx[idx_max]
-            # Compute dTstar_dz over grid
-            dTstar_dz = vmap(jacrev(learner_T_star.model.decoder))(z)
             dTstar_dz = dTstar_dz[:, :, : learner_T_star.model.dim_z]
             idxstar_max = torch.argmax(
                 torch.linalg.matrix_norm(dTstar_dz, ord=2))
             Tstar_max = dTstar_dz[idxstar_max]
-            # Save this data
-            # import pandas as pd
-            # import os
-            # path = os.path.join(learner_T_star.results_folder, 'gradients')
-            # os.makedirs(path, exist_ok=True)
-            file = pd.DataFrame(Tmax)
-            file.to_csv(os.path.join(path, f'Tmax.csv'), header=False)
-            file = pd.DataFrame(Tstar_max)
-            file.to_csv(os.path.join(path, f'Tstar_max.csv'), header=False)
-            file = pd.DataFrame(dTdx.flatten(1, -1))
-            file.to_csv(os.path.join(path, f'dTdx.csv'), header=False)
-            file = pd.DataFrame(dTstar_dz.flatten(1, -1))
-            file.to_csv(os.path.join(path, f'dTstar_dz.csv'), header=False)
+            # Save this data (binary, shapes are preserved)
+            for name, array in [('Tmax', Tmax), ('Tstar_max', Tstar_max),
+                                ('dTdx', dTdx), ('dTstar_dz', dTstar_dz)]:
+                torch.save(array.contiguous().cpu(),
+                           os.path.join(path, f'{name}.pt'))
 
         else:
             # Saved
             path = os.path.join(learner_T_star.results_folder, 'gradients')
-            df = pd.read_csv(os.path.join(path, f'mesh.csv'), sep=',',
-                             header=None)
-            mesh = torch.from_numpy(df.drop(df.columns[0], axis=1).values)
-            df = pd.read_csv(os.path.join(path, f'Tmax.csv'), sep=',',
-                             header=None)
-            Tmax = torch.from_numpy(df.drop(df.columns[0], axis=1).values)
-            df = pd.read_csv(os.path.join(path, f'dTdx.csv'), sep=',',
-                             header=None)
-            dTdx = torch.from_numpy(
-                df.drop(df.columns[0], axis=1).values).reshape(
-                (-1, Tmax.shape[0], Tmax.shape[1]))
-            df = pd.read_csv(os.path.join(path, f'Tstar_max.csv'), sep=',',
-                             header=None)
-            Tstar_max = torch.from_numpy(df.drop(df.columns[0], axis=1).values)
-            df = pd.read_csv(os.path.join(path, f'dTstar_dz.csv'), sep=',',
-                             header=None)
-            dTstar_dz = torch.from_numpy(
-                df.drop(df.columns[0], axis=1).values).reshape(
-                (-1, Tstar_max.shape[0], Tstar_max.shape[1]))
+
+            def load_array(name):
+                # Memory-mapped load from torch.save, or from numpy .npy for
+                # arrays archived in that format (copy-on-write mapping)
+                file = os.path.join(path, name)
+                if os.path.isfile(file + '.pt'):
+                    return torch.load(file + '.pt', map_location='cpu',
+                                      mmap=True)
+                return torch.from_numpy(np.load(file + '.npy', mmap_mode='c'))
+
+            mesh = load_array('mesh')
+            Tmax = load_array('Tmax')
+            dTdx = load_array('dTdx')
+            Tstar_max = load_array('Tstar_max')
+            dTstar_dz = load_array('dTstar_dz')
 
         # Plots
         plt.rcParams['axes.grid'] = False
@@ -350,69 +358,79 @@ if __name__ == "__main__":
         with torch.no_grad():
             T = learner_T_star.model.encoder(x)
             Tstar = learner_T_star.model.decoder(z)
-        # Plot T and its gradients over grid of x
+        x_np, z_np = x.numpy(), z.numpy()
+        # Symmetric color limits of all heatmaps, computed once
+        m_T = T.abs().amax(dim=0)
+        m_dTdx = dTdx.abs().amax(dim=0)
+        m_Tstar = Tstar.abs().amax(dim=0)
+        m_dTstar = dTstar_dz.abs().amax(dim=0)
+        # Plot T and its gradients over grid of x: reuse the same figure,
+        # scatter and colorbar for all heatmaps and only update their data
+        fig, ax = plt.subplots()
+        sc = ax.scatter(x_np[:, 0], x_np[:, 1], cmap="jet", c=T[:, 0].numpy())
+        cbar = fig.colorbar(sc, ax=ax)
         for i in range(len(learner_T_star.x_idx_in) - 1):
+            sc.set_offsets(x_np[:, i:i + 2])
+            ax.ignore_existing_data_limits = True
+            ax.update_datalim(x_np[:, i:i + 2])
+            ax.autoscale_view()
+            ax.set_xlabel(rf'$x_{i + 1}$')
+            ax.set_ylabel(rf'$x_{i + 2}$')
             for j in range(len(learner_T_star.z_idx_out)):
                 name = f'T{j}_{i}.pdf'
-                plt.scatter(x[:, i], x[:, i + 1], cmap="jet", c=T[:, j])
-                m = torch.max(torch.abs(T[:, j]))
-                plt.clim(-m, m)
-                plt.colorbar()
-                plt.xlabel(rf'$x_{i + 1}$')
-                plt.ylabel(rf'$x_{i + 2}$')
-                plt.title(rf'$T_{j + 1}(x)$')
-                plt.savefig(os.path.join(path, name), bbox_inches="tight")
+                m = m_T[j].item()
+                sc.set_array(T[:, j].numpy())
+                sc.set_clim(-m, m)
+                cbar.update_normal(sc)
+                ax.set_title(rf'$T_{j + 1}(x)$')
+                fig.savefig(os.path.join(path, name), bbox_inches="tight")
                 if verbose:
                     plt.show()
-                plt.clf()
-                plt.close('all')
 
                 for k in range(len(learner_T_star.x_idx_in)):
                     name = f'dT{j}dx{k}_{i}.pdf'
-                    plt.scatter(x[:, i], x[:, i + 1], cmap="jet",
-                                c=dTdx[:, j, k])
-                    m = torch.max(torch.abs(dTdx[:, j, k]))
-                    plt.clim(-m, m)
-                    plt.colorbar()
-                    plt.xlabel(rf'$x_{i + 1}$')
-                    plt.ylabel(rf'$x_{i + 2}$')
-                    plt.title(
+                    m = m_dTdx[j, k].item()
+                    sc.set_array(dTdx[:, j, k].numpy())
+                    sc.set_clim(-m, m)
+                    cbar.update_normal(sc)
+                    ax.set_title(
                         rf'$\frac{{\partial T_{j + 1}}}{{\partial x_{k + 1}}}(x)$')
-                    plt.savefig(os.path.join(path, name), bbox_inches="tight")
+                    fig.savefig(os.path.join(path, name), bbox_inches="tight")
                     if verbose:
                         plt.show()
-                    plt.clf()
-                    plt.close('all')
-        # Plot Tstar and its gradients over grid of z
+        plt.close(fig)
+        # Plot Tstar and its gradients over grid of z, reusing one figure
+        fig, ax = plt.subplots()
+        sc = ax.scatter(z_np[:, 0], z_np[:, 1], cmap="jet",
+                        c=Tstar[:, 0].numpy())
+        cbar = fig.colorbar(sc, ax=ax)
         for i in range(len(learner_T_star.z_idx_in) - 1):
+            sc.set_offsets(z_np[:, i:i + 2])
+            ax.ignore_existing_data_limits = True
+            ax.update_datalim(z_np[:, i:i + 2])
+            ax.autoscale_view()
+            ax.set_xlabel(rf'$z_{i + 1}$')
+            ax.set_ylabel(rf'$z_{i + 2}$')
             for j in range(len(learner_T_star.x_idx_out)):
                 name = f'Tstar{j}_{i}.pdf'
-                plt.scatter(z[:, i], z[:, i + 1], cmap="jet", c=Tstar[:, j])
-                m = torch.max(torch.abs(Tstar[:, j]))
-                plt.clim(-m, m)
-                plt.colorbar()
-                plt.xlabel(rf'$z_{i + 1}$')
-                plt.ylabel(rf'$z_{i + 2}$')
-                plt.title(rf'$T^*_{j + 1}(z)$')
-                plt.savefig(os.path.join(path, name), bbox_inches="tight")
+                m = m_Tstar[j].item()
+                sc.set_array(Tstar[:, j].numpy())
+                sc.set_clim(-m, m)
+                cbar.update_normal(sc)
+                ax.set_title(rf'$T^*_{j + 1}(z)$')
+                fig.savefig(os.path.join(path, name), bbox_inches="tight")
                 if verbose:
                     plt.show()
-                plt.clf()
-                plt.close('all')
 
                 for k in range(len(learner_T_star.z_idx_in)):
                     name = f'dTstar{j}dz{k}_{i}.pdf'
-                    plt.scatter(z[:, i], z[:, i + 1], cmap="jet",
-                                c=dTstar_dz[:, j, k])
-                    m = torch.max(torch.abs(dTstar_dz[:, j, k]))
-                    plt.clim(-m, m)
-                    plt.colorbar()
-                    plt.xlabel(rf'$z_{i + 1}$')
-                    plt.ylabel(rf'$z_{i + 2}$')
-                    plt.title(rf'$\frac{{\partial T^*_{j + 1}}}{{\partial z_'
-                              rf'{k + 1}}}(z)$')
-                    plt.savefig(os.path.join(path, name), bbox_inches="tight")
+                    m = m_dTstar[j, k].item()
+                    sc.set_array(dTstar_dz[:, j, k].numpy())
+                    sc.set_clim(-m, m)
+                    cbar.update_normal(sc)
+                    ax.set_title(rf'$\frac{{\partial T^*_{j + 1}}}{{\partial z_'
+                                 rf'{k + 1}}}(z)$')
+                    fig.savefig(os.path.join(path, name), bbox_inches="tight")
                     if verbose:
                         plt.show()
-                    plt.clf()
-                    plt.close('all')
+        plt.close(fig)
@@ -25,7 +25,6 @@ from learn_KKL.filter_utils import EKF_ODE, interpolate_func, \
 import pytorch_lightning as pl
 from pytorch_lightning.callbacks import ModelCheckpoint
 from pytorch_lightning.loggers import TensorBoardLogger
-from sklearn.model_selection import train_test_split
 import torch.optim as optim
 import os
 import matplotlib.pyplot as plt
@@ -102,7 +101,8 @@ if __name__ == "__main__":
                 stack=False, dt=dt
             )
             data_ordered = copy.deepcopy(data)
-            data = torch.cat(torch.unbind(data, dim=1), dim=0)
+            # Stack trajectories one after the other in a single copy
+            data = data.transpose(0, 1).reshape(-1, data.shape[-1])
             if add_forward:  # add one forward trajectory to dataset
                 init = torch.tensor([0., 0.1, 0., 0.] + [0.] * observer.dim_z)
                 data_forward = observer.generate_data_forward(
@@ -118,7 +118,9 @@ if __name__ == "__main__":
                     init=init, tsim=(0, 8),
                     num_datapoints=200, k=10, dt=dt, stack=True)
                 data = torch.cat((data, data_forward), dim=0)
-        data, val_data = train_test_split(data, test_size=0.3, shuffle=False)
+        # Split last 30% of data for validation (no shuffling)
+        n_val = int(np.ceil(0.3 * len(data)))
+        data, val_data = data[:-n_val], data[-n_val:]
 
         print(data.shape)
 
@@ -157,6 +159,18 @@ if __name__ == "__main__":
             mode="min"
         )
 
+        # Compile the forward passes of the encoder/decoder MLPs on GPU only
+        # (no speedup on CPU). Dynamic shapes since the batch size differs
+        # between training, validation and test trajectories. The compiled
+        # methods are instance attributes, so the state dict of the observer
+        # is unchanged and deleting them restores the plain methods.
+        compile_model = torch.cuda.is_available()
+        if compile_model:
+            observer.forward_T = torch.compile(
+                observer.forward_T, mode='default', dynamic=True)
+            observer.forward_T_star = torch.compile(
+                observer.forward_T_star, mode='default', dynamic=True)
+
         # Instantiate learner
         learner = Learner(
             observer=observer,
@@ -181,13 +195,14 @@ if __name__ == "__main__":
             learner.num_samples = num_samples
 
         # Define logger and checkpointing
-        logger = TensorBoardLogger(save_dir=learner.results_folder + "/tb_logs")
+        logger = TensorBoardLogger(save_dir=learner.results_folder + "/tb_logs",
+                                   flush_secs=120, default_hp_metric=False)
         checkpoint_callback = ModelCheckpoint(monitor="val_loss")
         trainer = pl.Trainer(
             callbacks=[stopper, checkpoint_callback],
             **trainer_options,
             logger=logger,
-            log_every_n_steps=1,
+            log_every_n_steps=50,
             check_val_every_n_epoch=2
         )
 
@@ -199,6 +214,9 @@ if __name__ == "__main__":
 
         # Train and save results
         trainer.fit(learner)
+        if compile_model:
+            # Compiled functions cannot be pickled with the learner
+            del observer.forward_T, observer.forward_T_star
 
         # To see logger in tensorboard, copy the following output name_of_folder
         print(f"Logs stored in {learner.results_folder}/tb_logs")
@@ -263,12 +281,17 @@ if __name__ == "__main__":
     fileName = 'example_csv_fin4'
     filepath = 'Data/QQS2_data_diffx0/' + fileName + '.csv'
     exp_data = np.genfromtxt(filepath, delimiter=',')
-    tq_exp = torch.from_numpy(exp_data[1:2001, -1] - exp_data[1, -1])
-    exp_data = exp_data[1:2001, 1:-1]
-    exp_data = torch.from_numpy(system.remap_hardware(exp_data))
+    # Convert once to contiguous arrays of the dtype used by the observer
+    dtype = torch.get_default_dtype()
+    tq_exp = torch.as_tensor(exp_data[1:2001, -1] - exp_data[1, -1],
+                             dtype=dtype)
+    exp_data = np.ascontiguousarray(exp_data[1:2001, 1:-1])
+    exp_data = torch.as_tensor(system.remap_hardware(exp_data), dtype=dtype)
 
     # Observer
-    t_exp = torch.cat((tq_exp.unsqueeze(1), exp_data), dim=1)
+    t_exp = torch.empty((len(tq_exp), exp_data.shape[1] + 1))
+    t_exp[:, 0] = tq_exp
+    t_exp[:, 1:] = exp_data
     exp_func = interpolate_func(x=t_exp, t0=tq_exp[0], init_value=exp_data[0])
     tq = torch.arange(tsim[0], tsim[1], dt)
     exp = exp_func(tq)
@@ -306,14 +329,16 @@ if __name__ == "__main__":
     EKF_observer = EKF_ODE('cpu', dyn_config)
     y_func = interpolate_func(x=y, t0=tq[0], init_value=measurement[0])
     controller = lambda t, kwargs, t0, init_control, impose_init: 0.
-    x0_estim = torch.cat((
-        measurement[0].unsqueeze(1), torch.zeros(1, 3),
-        torch.unsqueeze(torch.flatten(dyn_config['prior_kwargs'][
-                                          'EKF_init_covar']), 0)), dim=1)
+    # Flat EKF state (mean, covariance): fill it through views
+    n = dyn_config['prior_kwargs']['n']
+    x0_estim = torch.zeros((1, n + n ** 2))
+    x0_estim[:, :measurement.shape[1]] = measurement[0]
+    x0_estim[:, n:].view(n, n).copy_(
+        dyn_config['prior_kwargs']['EKF_init_covar'])
     xtraj = dynamics_traj_observer(
         x0=x0_estim, u=controller, y=y_func, t0=tq[0],
         dt=dt, init_control=0., version=EKF_observer, t_eval=tq, GP=system,
-        kwargs=dyn_config)
+        compile_dynamics=True, kwargs=dyn_config)
     estimation_EKF = xtraj[:, :exp.shape[1]]
     rmse_EKF = RMSE(exp, estimation_EKF, dim=0)
     for i in range(estimation.shape[1]):
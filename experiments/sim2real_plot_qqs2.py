@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 
 # Import base utils
-import copy
+import glob
+import os
 import pathlib
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
 import numpy as np
+import pandas as pd
 import torch
 
 # In order to import learn_KKL we need to add the working dir to the system path
@@ -14,7 +19,7 @@ working_path = str(pathlib.Path().resolve())
 sys.path.append(working_path)
 
 # Import KKL observer
-from learn_KKL.system import QuanserQubeServo2
+from learn_KKL.system import QuanserQubeServo2, qqs2_dynamics, simulate_fn
 
 # Plot measured and simulated trajectories of the Quanser Qube
 
@@ -22,45 +27,74 @@ if __name__ == "__main__":
     system = QuanserQubeServo2()
     dt = 0.004
     tsim = (0, 2000 * dt)
+    STRIDE = 10  # plot one marker every STRIDE time steps
 
-    # Experiment
-    fileName = 'example_csv_fin4'
-    path = 'Data/QQS2_data_diffx0/' + fileName
-    exp = np.genfromtxt(path + '.csv', delimiter=',')
-    exp = exp[1:2001, 1:-1]
-    exp = system.remap_hardware(exp, add_pi_alpha=False)
+    # Experiments: all CSV files of the dataset
+    paths = sorted(os.path.splitext(file)[0] for file in
+                   glob.glob('Data/QQS2_data_diffx0/*.csv'))
 
-    # Simulation
-    x0 = torch.from_numpy(exp[0])
-    tq, simu = system.simulate(x_0=x0, tsim=tsim, dt=dt)
-    simu = system.remap(simu)
+    def load_experiment(path):
+        # Parse the first 2000 rows without the first and last columns once
+        # with the C parser of pandas, then reuse the array cached as .npy
+        if os.path.isfile(path + '.npy') and \
+                os.path.getmtime(path + '.npy') >= os.path.getmtime(
+                    path + '.csv'):
+            exp = np.load(path + '.npy')
+        else:
+            ncols = len(pd.read_csv(path + '.csv', nrows=0).columns)
+            exp = pd.read_csv(path + '.csv', header=0, nrows=2000,
+                              usecols=range(1, ncols - 1),
+                              dtype=np.float64).to_numpy()
+            # pandas returns a column-major block: store it row-major once
+            exp = np.ascontiguousarray(exp)
+            np.save(path + '.npy', exp)
+        return system.remap_hardware(exp, add_pi_alpha=False)
 
-    # Compare both
-    plt.plot(tq, simu[:, 0], 'x', label=r'simulated $\theta$')
-    plt.plot(tq, exp[:, 0], 'x', label=r'experimental $\theta$')
-    plt.legend()
-    plt.savefig(path + '_theta.pdf', bbox_inches="tight")
-    plt.show()
-    plt.clf()
-    plt.close('all')
-    plt.plot(tq, simu[:, 1], 'x', label=r'simulated $\alpha$')
-    plt.plot(tq, exp[:, 1], 'x', label=r'experimental $\alpha$')
-    plt.legend()
-    plt.savefig(path + '_alpha.pdf', bbox_inches="tight")
-    plt.show()
-    plt.clf()
-    plt.close('all')
-    plt.plot(tq, simu[:, 2], 'x', label=r'simulated $\dot{\theta}$')
-    plt.plot(tq, exp[:, 2], 'x', label=r'experimental $\dot{\theta}$')
-    plt.legend()
-    plt.savefig(path + '_thetadot.pdf', bbox_inches="tight")
-    plt.show()
-    plt.clf()
-    plt.close('all')
-    plt.plot(tq, simu[:, 3], 'x', label=r'simulated $\dot{\alpha}$')
-    plt.plot(tq, exp[:, 3], 'x', label=r'experimental $\dot{\alpha}$')
-    plt.legend()
-    plt.savefig(path + '_alphadot.pdf', bbox_inches="tight")
-    plt.show()
-    plt.clf()
-    plt.close('all')
+    # Files are independent: load them on a pool of threads (the parsing
+    # and file reads release the GIL), then simulate them all in one batch
+    with ThreadPoolExecutor() as executor:
+        exps = list(executor.map(load_experiment, paths))
+
+    # Simulation of all experiments at once from their initial states with
+    # fixed-step RK4, on GPU if available, then back to CPU for plotting.
+    # Single precision is enough to compare with the encoder measurements.
+    # A single experiment on CPU goes through the numba/scipy fast path,
+    # with tolerances giving errors within the markers (< 0.005 rad).
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if device == 'cpu' and len(exps) == 1:
+        tq, simus = system.simulate_numba(x_0=exps[0][0], tsim=tsim, dt=dt)
+        simus = simus[:, None]
+    else:
+        x0 = torch.from_numpy(np.stack([exp[0] for exp in exps]).astype(
+            np.float32)).to(device)
+        system.to(device=device, dtype=torch.float32)
+        # Fixed-step RK4 of the pure QQS2 dynamics, with their elementwise
+        # ops fused, compiled once for the static batch shape. Not
+        # 'reduce-overhead': CUDA graphs would overwrite the output of the
+        # dynamics between the stages of RK4.
+        dynamics = torch.compile(qqs2_dynamics, dynamic=False, fullgraph=True)
+        tq = torch.arange(tsim[0], tsim[1], dt, device=device)
+        simus = simulate_fn(system.params, x0, tq, dynamics)
+        tq = tq.cpu().numpy()
+        simus = system.remap(simus).cpu().numpy()
+
+    # Compare both, all states in one figure saved without display. Figures
+    # are not registered with pyplot, so they can be written to PDF on
+    # helper threads while the next one is drawn.
+    labels = [r'$\theta$', r'$\alpha$', r'$\dot{\theta}$', r'$\dot{\alpha}$']
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = []
+        for i, (path, exp) in enumerate(zip(paths, exps)):
+            simu = simus[:, i]
+            fig = Figure(figsize=(6.4, 9.6))
+            axes = fig.subplots(4, 1, sharex=True)
+            for k, label in enumerate(labels):
+                axes[k].plot(tq[::STRIDE], simu[::STRIDE, k], 'x',
+                             label='simulated ' + label)
+                axes[k].plot(tq[::STRIDE], exp[::STRIDE, k], 'x',
+                             label='experimental ' + label)
+                axes[k].legend()
+            futures.append(executor.submit(
+                fig.savefig, path + '_all.pdf', bbox_inches="tight"))
+        for future in futures:
+            future.result()
@@ -9,7 +9,7 @@ import pandas as pd
 import numpy as np
 import dill as pkl
 import seaborn as sb
-from functorch import vmap, jacfwd, jacrev
+from torch.func import vmap, jacfwd, jacrev
 
 from learn_KKL.utils import compute_h_infinity, RMSE
 from learn_KKL.filter_utils import interpolate_func
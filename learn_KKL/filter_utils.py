@@ -1,10 +1,11 @@
 import torch
 import numpy as np
 from scipy.interpolate import interp1d
-from torchinterp1d import Interp1d
 from typing import Callable
 from torchdiffeq import odeint
 
+from .utils import interp_linear
+
 # Useful functions for filtering: EKF...
 # Mostly code from other repos added here for transfers
 
@@ -151,22 +152,12 @@ def interpolate_func(x, t0, init_value, method='linear', impose_init=False) -> \
             if method != 'linear':
                 raise NotImplementedError(
                     'Only linear interpolator available in pytorch!')
-            points, values = reshape_dim1(x[:, 0].contiguous()).t(), \
-                             reshape_dim1(x[:, 1:].contiguous()).t()
-            interp_function = Interp1d()
+            points, values = x[:, 0].contiguous(), x[:, 1:].contiguous()
 
             def interp(t, *args, **kwargs):
-                if len(t.shape) == 0:
-                    t = t.view(1, 1)
-                else:
-                    t = reshape_dim1(t.contiguous()).t()
-                if len(x) == 1:
-                    # If only one value of x available, assume constant
-                    interpolate_x = x[0, 1:].repeat(len(t[0]), 1)
-                else:
-                    interpolate_x = interp_function(points.expand(
-                        values.shape[0], -1), values, t).t()
-                if t[0, 0] == t0 and impose_init:
+                t = t.reshape(-1).to(points.dtype)
+                interpolate_x = interp_linear(points, values, t)
+                if t[0] == t0 and impose_init:
                     # Impose initial value
                     interpolate_x[0] = reshape_pt1(init_value)
                 return interpolate_x
@@ -198,7 +189,8 @@ def interpolate_func(x, t0, init_value, method='linear', impose_init=False) -> \
 def dynamics_traj_observer(x0, u, y, t0, dt, init_control, discrete=False,
                            version=None, method='dopri5', t_eval=[0.1],
                            GP=None, stay_GPU=False, lightning=False,
-                           impose_init_control=False, **kwargs):
+                           impose_init_control=False, compile_dynamics=False,
+                           **kwargs):
     # Go to GPU at the beginning of simulation
     if torch.cuda.is_available() and not lightning:
         x0 = x0.cuda()
@@ -252,6 +244,13 @@ def dynamics_traj_observer(x0, u, y, t0, dt, init_control, discrete=False,
             return version(tl, xl, u, y, t0, init_control, GP,
                            impose_init_control=impose_init_control, **kwargs)
 
+        if compile_dynamics:
+            # Fuse the small ops of the observer dynamics evaluated at each
+            # solver stage. Default mode: CUDA graphs (reduce-overhead) do
+            # not pay off on such tiny graphs, and graph breaks (e.g. on the
+            # interpolation of y) simply fall back to eager
+            f = torch.compile(f, mode='default')
+
         if len(t_eval) == 1:
             # t0 always needed for odeint, then deleted
             t_eval = torch.cat((torch.tensor([t0], device=device), t_eval))
@@ -280,6 +279,9 @@ class EKF_ODE:
         self.n = kwargs.get('prior_kwargs').get('n')
         self.C = reshape_pt1(
             kwargs.get('prior_kwargs').get('observation_matrix'))
+        # Constant measurement covariance: invert it once
+        self.meas_covar_inv = torch.inverse(
+            kwargs.get('prior_kwargs').get('EKF_meas_covar'))
 
     def __call__(self, t, xhat, u, y, t0, init_control, ODE, kwargs,
                  impose_init_control=False):
@@ -318,8 +320,8 @@ class EKF_ODE:
             mean = torch.zeros_like(xhat)
             mean_deriv = torch.zeros((self.n, self.n), device=device)
         # Update step: compute correction term for xhatdot, K, and covarhatdot
-        K = torch.matmul(torch.matmul(covarhat, self.C.t()), torch.inverse(
-            kwargs.get('prior_kwargs').get('EKF_meas_covar')))
+        K = torch.matmul(torch.matmul(covarhat, self.C.t()),
+                         self.meas_covar_inv)
         S = torch.matmul(mean_deriv, covarhat)
         xhatdot = mean + \
                   torch.matmul(K, y.t() - torch.matmul(self.C, xhat.t())).t()
@@ -327,5 +329,8 @@ class EKF_ODE:
                       kwargs.get('prior_kwargs').get('EKF_process_covar') - \
                       torch.matmul(torch.matmul(K, kwargs.get(
                           'prior_kwargs').get('EKF_meas_covar')), K.t())
-        return torch.cat((reshape_pt1(xhatdot),
-                          reshape_pt1(torch.flatten(covarhatdot))), dim=1)
\ No newline at end of file
+        # Write mean and covariance derivatives into views of one flat state
+        xdot = torch.empty_like(x)
+        xdot[:, :self.n] = reshape_pt1(xhatdot)
+        xdot[:, self.n:].view(self.n, self.n).copy_(covarhatdot)
+        return xdot
\ No newline at end of file
@@ -10,7 +10,7 @@ import pytorch_lightning as pl
 import seaborn as sb
 import torch
 import torch.optim as optim
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, BatchSampler, RandomSampler
 
 from .utils import RMSE, StandardScaler
 
@@ -241,11 +241,18 @@ class Learner(pl.LightningModule):
         else:
             raise KeyError(f"Unknown method {self.method}")
 
+    def batch_dataloader(self, data):
+        # The whole dataset fits in memory: upload it once to the device of
+        # the model and draw each shuffled minibatch with a single indexing
+        # op, instead of transferring and stacking samples one by one
+        data = data.to(self.device)
+        sampler = BatchSampler(RandomSampler(data),
+                               batch_size=self.batch_size, drop_last=False)
+        return DataLoader(data, batch_size=None, sampler=sampler,
+                          num_workers=0)
+
     def train_dataloader(self):
-        train_loader = DataLoader(
-            self.training_data, batch_size=self.batch_size, shuffle=True,
-            num_workers=0
-        )
+        train_loader = self.batch_dataloader(self.training_data)
         return train_loader
 
     def training_step(self, batch, batch_idx):
@@ -254,20 +261,20 @@ class Learner(pl.LightningModule):
             z_hat, x_hat = self.forward(batch)
             loss, loss1, loss2 = self.model.loss(self.method, batch, x_hat,
                                                  z_hat)
-            self.log("train_loss1", loss1, on_step=True, prog_bar=False,
-                     logger=True)
-            self.log("train_loss2", loss2, on_step=True, prog_bar=False,
-                     logger=True)
+            self.log("train_loss1", loss1, on_step=False, on_epoch=True,
+                     prog_bar=False, logger=True)
+            self.log("train_loss2", loss2, on_step=False, on_epoch=True,
+                     prog_bar=False, logger=True)
         elif self.method == "Autoencoder_jointly":
             z_hat, x_hat = self.forward(batch)
             loss, loss1, loss2, loss3 = self.model.loss(self.method, batch,
                                                         x_hat, z_hat)
-            self.log("train_loss1", loss1, on_step=True, prog_bar=False,
-                     logger=True)
-            self.log("train_loss2", loss2, on_step=True, prog_bar=False,
-                     logger=True)
-            self.log("train_loss3", loss3, on_step=True, prog_bar=False,
-                     logger=True)
+            self.log("train_loss1", loss1, on_step=False, on_epoch=True,
+                     prog_bar=False, logger=True)
+            self.log("train_loss2", loss2, on_step=False, on_epoch=True,
+                     prog_bar=False, logger=True)
+            self.log("train_loss3", loss3, on_step=False, on_epoch=True,
+                     prog_bar=False, logger=True)
         elif self.method == "T":
             z = batch[:, self.z_idx_out]
             z_hat = self.forward(batch)
@@ -276,19 +283,15 @@ class Learner(pl.LightningModule):
             x = batch[:, self.x_idx_out]
             x_hat = self.forward(batch)
             loss = self.model.loss(self.method, x, x_hat)
-        self.log("train_loss", loss, on_step=True, prog_bar=True, logger=True)
+        self.log("train_loss", loss, on_step=False, on_epoch=True,
+                 prog_bar=True, logger=True)
         self.train_loss = torch.cat((self.train_loss, torch.tensor([[loss]])))
         logs = {"train_loss": loss.detach()}
 
         return {"loss": loss, "log": logs}
 
     def val_dataloader(self):
-        val_dataloader = DataLoader(
-            self.validation_data,
-            batch_size=self.batch_size,
-            shuffle=True,
-            num_workers=0,
-        )
+        val_dataloader = self.batch_dataloader(self.validation_data)
         return val_dataloader
 
     def validation_step(self, batch, batch_idx):
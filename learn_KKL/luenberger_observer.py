@@ -99,10 +99,9 @@ from scipy import linalg
 from scipy import signal
 from torch import nn
 from torchdiffeq import odeint
-from functorch import vmap, jacfwd
+from torch.func import vmap, jacfwd
 
-from torchinterp1d import Interp1d
-from .utils import MSE, generate_mesh, MLPn
+from .utils import MSE, generate_mesh, MLPn, interp_linear
 
 # Set double precision by default
 torch.set_default_tensor_type(torch.DoubleTensor)
@@ -689,7 +688,8 @@ class LuenbergerObserver(nn.Module):
             Step width of tsim.
 
         only_x: bool
-            Whether to simulate both x and z or only x.
+            Whether to simulate both x and z or only x. If only x, y_0 may
+            also contain only x.
 
         Returns
         ----------
@@ -769,13 +769,12 @@ class LuenbergerObserver(nn.Module):
             abs(linalg.eig(self.D.detach().numpy())[0].real))
         print(self.t_c)
 
-        y_0 = torch.zeros((num_samples, self.dim_x + self.dim_z))  # TODO
-        y_1 = y_0.clone()
+        y_1 = torch.zeros((num_samples, self.dim_x + self.dim_z))
 
-        # Simulate only x system backward in time
+        # Simulate only x system backward in time, for all initial
+        # conditions at once: z is not needed, so leave it out of the state
         tsim = (0, -self.t_c)
-        y_0[:, : self.dim_x] = mesh
-        _, data_bw = self.simulate_system(y_0, tsim, -dt, only_x=True)
+        _, data_bw = self.simulate_system(mesh, tsim, -dt, only_x=True)
 
         # Simulate both x and z forward in time starting from the last point
         # from previous simulation
@@ -861,7 +860,7 @@ class LuenbergerObserver(nn.Module):
 
         # Fix issue with grad tensor in pipeline
         if stack:
-            return torch.cat(torch.unbind(data, dim=1), dim=0)
+            return data.transpose(0, 1).reshape(-1, data.shape[-1])
         else:
             return data
 
@@ -929,26 +928,12 @@ class LuenbergerObserver(nn.Module):
         # Don't save backpropagation
         with torch.no_grad():
 
-            # Create list of interp1d functions
-            points, values = (
-                x[:, 0].contiguous().view(-1, 1).t(),
-                x[:, 1:].contiguous().view(-1, x.shape[1] - 1).t(),
-            )
-            interp_function = Interp1d()
+            # Time points and values of piecewise linear interpolation
+            points, values = x[:, 0].contiguous(), x[:, 1:].contiguous()
 
             def interp(t, *args, **kwargs):
-                if len(t.shape) == 0:
-                    t = t.view(1, 1)
-                else:
-                    t = t.contiguous().view(-1, 1).t()
-                if len(x) == 1:
-                    # If only one value of x available, assume constant
-                    interpolate_x = x[0, 1:].repeat(len(t[0]), 1)
-                else:
-                    interpolate_x = interp_function(
-                        points.expand(values.shape[0], -1), values, t
-                    ).t()
-                return interpolate_x
+                t = t.reshape(-1).to(points.dtype)
+                return interp_linear(points, values, t)
 
         return interp
 
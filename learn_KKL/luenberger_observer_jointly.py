@@ -4,7 +4,7 @@ import torch
 import scipy.linalg
 import numpy as np
 from torch import nn
-from functorch import vmap, jacrev
+from torch.func import vmap, jacrev
 
 from learn_KKL.luenberger_observer import LuenbergerObserver
 
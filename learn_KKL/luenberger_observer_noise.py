@@ -5,7 +5,7 @@ import os
 import numpy as np
 import pandas as pd
 import torch
-from functorch import jacfwd, vmap, jacrev
+from torch.func import jacfwd, vmap, jacrev
 from scipy import linalg
 from torch import nn
 
@@ -71,18 +71,90 @@ Copyright 2021 Lukas Bahr.
 
 from math import pi
 
-import copy
+import functools
 import numpy as np
 import torch
 from scipy import signal
+from scipy.integrate import solve_ivp
 from torchdiffeq import odeint
-from functorch import vmap, jacrev
+from torch.func import vmap, jacrev
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional: without it, jitted functions run as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 # Set double precision by default
 torch.set_default_tensor_type(torch.DoubleTensor)
 torch.set_default_dtype(torch.float64)
 
 
+def _torchode_dynamics(t, x, system):
+    # torchode solves batches of problems with one time per problem
+    return system.f(x) + system.g(x) * torch.reshape(system.u(t), (-1, 1))
+
+
+@functools.lru_cache(maxsize=None)
+def _torchode_solve(rtol, atol):
+    # Compiled solve of a dopri5 solver of torchode, built once per pair of
+    # tolerances. torch.compile of the solver module itself would only
+    # compile its forward, which AutoDiffAdjoint does not define.
+    import torchode
+    term = torchode.ODETerm(_torchode_dynamics, with_args=True)
+    step_method = torchode.Dopri5(term=term)
+    controller = torchode.IntegralController(atol=atol, rtol=rtol, term=term)
+    solver = torchode.AutoDiffAdjoint(step_method, controller)
+    return torch.compile(solver.solve)
+
+
+def simulate_fn(params, x_0: torch.tensor, tq: torch.tensor,
+                dynamics) -> torch.tensor:
+    """
+    Simulates dx/dt = dynamics(params, t, x) with a fixed-step Runge-Kutta 4
+    scheme on the time grid tq. Written as a pure function without in-place
+    operations, so that it can be transformed with torch.func, e.g.
+    vmap(simulate_fn, in_dims=(None, 0, None, None)) to simulate a batch of
+    initial states, or in_dims=(0, None, None, None) to simulate a batch of
+    parameters. vmap only maps over tensors: to batch the parameters of
+    QuanserQubeServo2.params, which are mostly floats, first convert them,
+    e.g. {key: torch.as_tensor(val).expand(n, *torch.as_tensor(val).shape)
+    for key, val in system.params.items()}, and vary the batched entries.
+
+    Parameters
+    ----------
+    params:
+        Parameters of the dynamics, e.g. a dict of tensors.
+
+    x_0: torch.tensor
+        Initial value for simulation.
+
+    tq: torch.tensor
+        Tensor of timesteps of the solution, starting with the time of x_0.
+
+    dynamics: callable
+        Function (params, t, x) -> dx/dt.
+
+    Returns
+    ----------
+    sol: torch.tensor
+        Solution of the simulation, of shape (len(tq),) + x_0.shape.
+    """
+    x = x_0
+    sol = [x]
+    for i in range(len(tq) - 1):
+        t = tq[i]
+        dt = tq[i + 1] - t
+        k1 = dynamics(params, t, x)
+        k2 = dynamics(params, t + dt / 2, x + dt / 2 * k1)
+        k3 = dynamics(params, t + dt / 2, x + dt / 2 * k2)
+        k4 = dynamics(params, t + dt, x + dt * k3)
+        x = x + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        sol.append(x)
+    return torch.stack(sol)
+
+
 class System:
     """ Implements a Luenberger observer. You are responsible for setting the
     state variables and functions to reasonable values; the defaults  will
@@ -131,9 +203,18 @@ class System:
     generate_mesh(limits: tuple, num_samples: int, method: string) : torch.tensor
         Returns 2D mesh for params either from LHS or uniform sampling.
 
-    simulate(x_0: torch.tensor, tsim: tuple, dt: float) : [torch.tensor, torch.tensor]
+    to(device=None, dtype=None) : System
+        Move the tensor attributes of the system to a device and dtype.
+
+    simulate(x_0: torch.tensor, tsim: tuple, dt: float, method: string = 'dopri5', rtol: float = 1e-7, atol: float = 1e-9) : [torch.tensor, torch.tensor]
         Simulate system in time.
 
+    simulate_rk4(x_0: torch.tensor, n_steps: int, dt: float, t_0: float = 0.) : [torch.tensor, torch.tensor]
+        Simulate system in time with a fixed-step Runge-Kutta 4 scheme.
+
+    simulate_torchode(x_0: torch.tensor, tq: torch.tensor, rtol: float = 1e-7, atol: float = 1e-9) : torch.tensor
+        Simulate system in time with the dopri5 solver of torchode (compiled solve).
+
     lin_chirp_controller(self, t: float, t_0: float = 0.0, a: float = 0.001, b: float = 9.99e-05) : torch.tensor
         Returns computed vector of a linear chirp function for time t.
 
@@ -178,14 +259,48 @@ class System:
         elif controller == "lin_chirp_controller":
             self.u = self.lin_chirp_controller
 
-    def simulate(self, x_0: torch.tensor, tsim: tuple, dt) -> torch.tensor:
+    def to(self, device=None, dtype=None):
+        """
+        Moves all tensor attributes of the system (e.g. coefficients of a
+        saturation) to the given device, so that simulations can run there
+        without transfers inside the dynamics, and optionally casts the
+        floating point ones to the given dtype.
+
+        Parameters
+        ----------
+        device: torch.device or str
+            Device on which to store the tensor attributes.
+
+        dtype: torch.dtype
+            Floating point type of the tensor attributes, e.g. torch.float32
+            to simulate in single precision (default: unchanged).
+
+        Returns
+        ----------
+        self: System
+            The system itself.
+        """
+        for key, val in vars(self).items():
+            if torch.is_tensor(val):
+                if val.is_floating_point():
+                    setattr(self, key, val.to(device=device, dtype=dtype))
+                else:
+                    setattr(self, key, val.to(device=device))
+        return self
+
+    def simulate(self, x_0: torch.tensor, tsim: tuple, dt,
+                 method='dopri5', rtol=1e-7, atol=1e-9) -> torch.tensor:
         """
         Simulates the system for given params.
 
         Parameters
         ----------
         x_0: torch.tensor
-            Initial value for simulation.
+            Initial value for simulation. Several initial values stacked in
+            shape (number of simulations, dim_x) are simulated jointly in a
+            single solver call. The simulation runs on the device of x_0,
+            where the tensor attributes of the system must also be (see
+            System.to).
 
         tsim: tuple
             Tuple of (Start, End) time of simulation.
@@ -193,6 +308,19 @@ class System:
         dt: float 
             Step width of tsim.
 
+        method: string
+            Solver of torchdiffeq to use, 'rk4' to use the fixed-step
+            Runge-Kutta 4 scheme of simulate_rk4 with step dt, which avoids
+            the overhead of the adaptive solvers on small systems, or
+            'torchode' to use the dopri5 solver of torchode with a compiled
+            solve, see simulate_torchode.
+
+        rtol: float
+            Relative tolerance of the adaptive solvers (ignored by 'rk4').
+
+        atol: float
+            Absolute tolerance of the adaptive solvers (ignored by 'rk4').
+
         Returns
         ----------
         tq: torch.tensor
@@ -207,16 +335,95 @@ class System:
             return x_dot
 
         # Output timestemps of solver
-        tq = torch.arange(tsim[0], tsim[1], dt)
+        tq = torch.arange(tsim[0], tsim[1], dt, device=x_0.device)
 
         # Solve
-        sol = odeint(dxdt, x_0, tq)
+        if method == 'rk4':
+            tq, sol = self.simulate_rk4(x_0, len(tq), dt, t_0=tsim[0])
+        elif method == 'torchode':
+            sol = self.simulate_torchode(x_0, tq, rtol=rtol, atol=atol)
+        else:
+            sol = odeint(dxdt, x_0, tq, method=method, rtol=rtol, atol=atol)
 
         if self.needs_remap:
             return tq, self.remap(torch.squeeze(sol))
         else:
             return tq, torch.squeeze(sol)
 
+    def simulate_rk4(self, x_0: torch.tensor, n_steps: int, dt,
+                     t_0=0.) -> torch.tensor:
+        """
+        Simulates the system with a fixed-step Runge-Kutta 4 scheme, without
+        step size control. The solution is neither squeezed nor remapped.
+
+        Parameters
+        ----------
+        x_0: torch.tensor
+            Initial value for simulation, possibly several stacked in shape
+            (number of simulations, dim_x).
+
+        n_steps: int
+            Number of time steps of the solution, including x_0.
+
+        dt: float
+            Step width.
+
+        t_0: float
+            Start time of simulation.
+
+        Returns
+        ----------
+        tq: torch.tensor
+            Tensor of timesteps.
+
+        sol: torch.tensor
+            Solution of the simulation, of shape (n_steps,) + x_0.shape.
+        """
+
+        def dxdt(params, t, x):
+            x_dot = self.f(x) + self.g(x) * self.u(t)
+            return x_dot
+
+        tq = t_0 + dt * torch.arange(n_steps, device=x_0.device)
+        return tq, simulate_fn(None, x_0, tq, dxdt)
+
+    def simulate_torchode(self, x_0: torch.tensor, tq: torch.tensor,
+                          rtol=1e-7, atol=1e-9) -> torch.tensor:
+        """
+        Simulates the system with the dopri5 solver of torchode. Its solve
+        method is compiled with torch.compile once per pair of tolerances
+        and shared by all systems, which are passed to the dynamics as
+        arguments. Requires the optional dependency torchode. The solution
+        is neither squeezed nor remapped.
+
+        Parameters
+        ----------
+        x_0: torch.tensor
+            Initial value for simulation, possibly several stacked in shape
+            (number of simulations, dim_x).
+
+        tq: torch.tensor
+            Tensor of timesteps at which to output the solution.
+
+        rtol: float
+            Relative tolerance of the step size controller.
+
+        atol: float
+            Absolute tolerance of the step size controller.
+
+        Returns
+        ----------
+        sol: torch.tensor
+            Solution of the simulation, of shape (len(tq),) + x_0.shape.
+        """
+        import torchode
+
+        y_0 = x_0.reshape(-1, x_0.shape[-1])
+        problem = torchode.InitialValueProblem(
+            y0=y_0, t_eval=tq.to(y_0.dtype).expand(len(y_0), -1))
+        sol = _torchode_solve(rtol, atol)(problem, args=self).ys
+        return torch.transpose(sol, 0, 1).reshape((len(tq),) + x_0.shape)
+
     def lin_chirp_controller(
         self, t: float, t_0: float = 0.0, a: float = 0.001, b: float = 9.99e-05
     ) -> torch.tensor:
@@ -437,6 +644,145 @@ class HO_unknown_freq(System):
         return "HO_unknown_freq"
 
 
+@njit(cache=True, fastmath=True)
+def _qqs2_terms(y, params):
+    # Terms a, b, c, den of the equations of motion of QuanserQubeServo2
+    # without control input, for a single state as a float64 array, from
+    # the constant factors derived from the attributes (see numba_params)
+    Lp2_mp, Lp_Lr_mp, Jp_eff, a_theta_dot, b_alpha_dot, b_sin, c0, \
+        den_cos2 = params[:8]
+    theta_dot = y[2]
+    alpha_dot = y[3]
+    sin_alpha = np.sin(y[1])
+    cos_alpha = np.cos(y[1])
+    sin_2alpha = 2.0 * sin_alpha * cos_alpha
+    a = (a_theta_dot * theta_dot
+         + Lp2_mp * alpha_dot * theta_dot * sin_2alpha
+         + 2.0 * Lp_Lr_mp * alpha_dot ** 2 * sin_alpha)
+    b = (b_alpha_dot * alpha_dot
+         + Lp2_mp * theta_dot ** 2 * sin_2alpha
+         + b_sin * sin_alpha)
+    c = c0 + Lp2_mp * sin_alpha ** 2
+    den = den_cos2 * cos_alpha ** 2 - Jp_eff * c
+    return a, b, c, den
+
+
+@njit(cache=True, fastmath=True)
+def _qqs2_rhs(t, y, params):
+    # Dynamics of QuanserQubeServo2 without control input, for a single
+    # state as a float64 array, to be integrated by scipy
+    Lp_Lr_mp, Jp_eff = params[1], params[2]
+    r, d, p0, p1, p2, p3 = params[8:]
+    a, b, c, den = _qqs2_terms(y, params)
+    cos_alpha = np.cos(y[1])
+
+    xnorm = np.sqrt(np.sum(y ** 2))
+    if xnorm <= r:
+        sat = 1.
+    elif xnorm < r + d:
+        x = xnorm - r
+        sat = p0 * x ** 3 + p1 * x ** 2 + p2 * x + p3
+    else:
+        sat = 0.
+
+    ydot = np.empty(4)
+    ydot[0] = sat * y[2]
+    ydot[1] = sat * y[3]
+    ydot[2] = sat * (-Lp_Lr_mp * b * cos_alpha + Jp_eff * a) / den
+    ydot[3] = sat * (2.0 * Lp_Lr_mp * a * cos_alpha - 0.5 * c * b) / den
+    return ydot
+
+
+@njit(cache=True, fastmath=True)
+def _qqs2_jac(t, y, params):
+    # Analytic Jacobian of _qqs2_rhs with respect to y, derived by hand from
+    # the same intermediate terms a, b, c, den
+    Lp2_mp, Lp_Lr_mp, Jp_eff, a_theta_dot, b_alpha_dot, b_sin, c0, \
+        den_cos2 = params[:8]
+    r, d, p0, p1, p2, p3 = params[8:]
+    theta_dot = y[2]
+    alpha_dot = y[3]
+    sin_alpha = np.sin(y[1])
+    cos_alpha = np.cos(y[1])
+    sin_2alpha = 2.0 * sin_alpha * cos_alpha
+    cos_2alpha = cos_alpha ** 2 - sin_alpha ** 2
+    a, b, c, den = _qqs2_terms(y, params)
+    n2 = -Lp_Lr_mp * b * cos_alpha + Jp_eff * a
+    n3 = 2.0 * Lp_Lr_mp * a * cos_alpha - 0.5 * c * b
+
+    # Partial derivatives of the terms wrt (alpha, theta_dot, alpha_dot)
+    da = (2.0 * Lp2_mp * alpha_dot * theta_dot * cos_2alpha
+          + 2.0 * Lp_Lr_mp * alpha_dot ** 2 * cos_alpha,
+          a_theta_dot + Lp2_mp * alpha_dot * sin_2alpha,
+          Lp2_mp * theta_dot * sin_2alpha
+          + 4.0 * Lp_Lr_mp * alpha_dot * sin_alpha)
+    db = (2.0 * Lp2_mp * theta_dot ** 2 * cos_2alpha + b_sin * cos_alpha,
+          2.0 * Lp2_mp * theta_dot * sin_2alpha,
+          b_alpha_dot)
+    dc = (Lp2_mp * sin_2alpha, 0., 0.)
+    dden = (-(den_cos2 + Jp_eff * Lp2_mp) * sin_2alpha, 0., 0.)
+    dcos = (-sin_alpha, 0., 0.)
+
+    jac = np.zeros((4, 4))
+    jac[0, 2] = 1.
+    jac[1, 3] = 1.
+    for i in range(3):
+        dn2 = -Lp_Lr_mp * (db[i] * cos_alpha + b * dcos[i]) + Jp_eff * da[i]
+        dn3 = 2.0 * Lp_Lr_mp * (da[i] * cos_alpha + a * dcos[i]) \
+            - 0.5 * (dc[i] * b + c * db[i])
+        jac[2, i + 1] = (dn2 * den - n2 * dden[i]) / den ** 2
+        jac[3, i + 1] = (dn3 * den - n3 * dden[i]) / den ** 2
+
+    # Saturation: d(sat * f) = sat * df + f * dsat
+    xnorm = np.sqrt(np.sum(y ** 2))
+    if xnorm <= r:
+        return jac
+    elif xnorm < r + d:
+        x = xnorm - r
+        sat = p0 * x ** 3 + p1 * x ** 2 + p2 * x + p3
+        dsat = (3.0 * p0 * x ** 2 + 2.0 * p1 * x + p2) * y / xnorm
+        ydot = np.array([theta_dot, alpha_dot, n2 / den, n3 / den])
+        return sat * jac + np.outer(ydot, dsat)
+    else:
+        return np.zeros((4, 4))
+
+
+def qqs2_dynamics(params, t, x, action=0.):
+    # Dynamics of QuanserQubeServo2 as a pure function of its parameters
+    # (QuanserQubeServo2.params), without in-place operations so that it can
+    # be transformed with torch.func, e.g. in simulate_fn
+    theta_dot = x[..., 2]
+    alpha_dot = x[..., 3]
+    sin_alpha = torch.sin(x[..., 1])
+    cos_alpha = torch.cos(x[..., 1])
+    sin_2alpha = 2.0 * sin_alpha * cos_alpha
+
+    # Terms of the equations of motion, with the constant factors derived
+    # in QuanserQubeServo2.params (-4 tau is folded into the first two)
+    a = (params['a_theta_dot'] * theta_dot + params['a_Vm'] * action
+         + params['Lp2_mp'] * alpha_dot * theta_dot * sin_2alpha
+         + 2.0 * params['Lp_Lr_mp'] * alpha_dot ** 2 * sin_alpha)
+    b = (params['b_alpha_dot'] * alpha_dot
+         + params['Lp2_mp'] * theta_dot ** 2 * sin_2alpha
+         + params['b_sin'] * sin_alpha)
+    c = params['c0'] + params['Lp2_mp'] * sin_alpha ** 2
+    den = params['den_cos2'] * cos_alpha ** 2 - params['Jp_eff'] * c
+    xdot = torch.stack([
+        theta_dot,
+        alpha_dot,
+        (-params['Lp_Lr_mp'] * b * cos_alpha + params['Jp_eff'] * a) / den,
+        (2.0 * params['Lp_Lr_mp'] * a * cos_alpha - 0.5 * c * b) / den],
+        dim=-1)
+
+    # Saturation = polynomial(norm(x) - r) between r and r + d
+    r, d, coef = params['r'], params['d'], torch.reshape(params['coef'], (-1,))
+    xnorm = torch.linalg.norm(x, 2, dim=-1)
+    xsat = xnorm - r
+    p = coef[0] * xsat ** 3 + coef[1] * xsat ** 2 + coef[2] * xsat + coef[3]
+    sat = torch.where(xnorm <= r, 1., torch.where(xnorm < r + d, p, 0.))
+    return xdot * torch.unsqueeze(sat, dim=-1)
+
+
 class QuanserQubeServo2(System):
     """ See https://www.quanser.com/products/qube-servo-2/ QUBE SERVO 2 and
     for a detailed reference for this system.
@@ -504,88 +850,34 @@ class QuanserQubeServo2(System):
         B = torch.tensor([[1.], [0], [0], [0]])
         return torch.linalg.solve(A, B)
 
-    def f(self, x, action=0.):
-        theta = x[..., 0]
-        alpha = x[..., 1]
-        theta_dot = x[..., 2]
-        alpha_dot = x[..., 3]
-
-        Vm = action
-        tau = -(self.km * (Vm - self.km * theta_dot)) / self.Rm
+    @property
+    def params(self):
+        # Parameters of qqs2_dynamics: constant factors of the equations of
+        # motion, derived from the current attributes at each call so that
+        # changing e.g. Dr or Rm after __init__ is taken into account
+        Lp2_mp = self.Lp ** 2 * self.mp
+        Lp_Lr_mp = self.Lp * self.Lr * self.mp
+        return {'Lp2_mp': Lp2_mp, 'Lp_Lr_mp': Lp_Lr_mp,
+                'Jp_eff': 4.0 * self.Jp + Lp2_mp,
+                'a_theta_dot': 4.0 * self.Dr - 4.0 * self.km ** 2 / self.Rm,
+                'a_Vm': 4.0 * self.km / self.Rm,
+                'b_alpha_dot': -8.0 * self.Dp,
+                'b_sin': 4.0 * self.Lp * self.gravity * self.mp,
+                'c0': 4.0 * self.Jr + 4.0 * self.Lr ** 2 * self.mp,
+                'den_cos2': 4.0 * Lp_Lr_mp ** 2, 'r': self.r, 'd': self.d,
+                'coef': self.coef}
 
-        xdot = torch.zeros_like(x)
-        xdot[..., 0] = theta_dot 
-        xdot[..., 1] = alpha_dot
-        xdot[..., 2] = (
-            -self.Lp
-            * self.Lr
-            * self.mp
-            * (
-                -8.0 * self.Dp * alpha_dot
-                + self.Lp ** 2 * self.mp * theta_dot ** 2 * torch.sin(2.0 * alpha)
-                + 4.0 * self.Lp * self.gravity * self.mp * torch.sin(alpha)
-            )
-            * torch.cos(alpha)
-            + (4.0 * self.Jp + self.Lp ** 2 * self.mp)
-            * (
-                4.0 * self.Dr * theta_dot
-                + self.Lp ** 2 * alpha_dot * self.mp * theta_dot * torch.sin(2.0 * alpha)
-                + 2.0 * self.Lp * self.Lr * alpha_dot ** 2 * self.mp * torch.sin(alpha)
-                - 4.0 * tau
-            )
-        ) / (
-            4.0 * self.Lp ** 2 * self.Lr ** 2 * self.mp ** 2 * torch.cos(alpha) ** 2
-            - (4.0 * self.Jp + self.Lp ** 2 * self.mp)
-            * (
-                4.0 * self.Jr
-                + self.Lp ** 2 * self.mp * torch.sin(alpha) ** 2
-                + 4.0 * self.Lr ** 2 * self.mp
-            )
-        )
-
-        xdot[..., 3] = (
-            2.0
-            * self.Lp
-            * self.Lr
-            * self.mp
-            * (
-                4.0 * self.Dr * theta_dot
-                + self.Lp ** 2 * alpha_dot * self.mp * theta_dot * torch.sin(2.0 * alpha)
-                + 2.0 * self.Lp * self.Lr * alpha_dot ** 2 * self.mp * torch.sin(alpha)
-                - 4.0 * tau
-            )
-            * torch.cos(alpha)
-            - 0.5
-            * (
-                4.0 * self.Jr
-                + self.Lp ** 2 * self.mp * torch.sin(alpha) ** 2
-                + 4.0 * self.Lr ** 2 * self.mp
-            )
-            * (
-                -8.0 * self.Dp * alpha_dot
-                + self.Lp ** 2 * self.mp * theta_dot ** 2 * torch.sin(2.0 * alpha)
-                + 4.0 * self.Lp * self.gravity * self.mp * torch.sin(alpha)
-            )
-        ) / (
-            4.0 * self.Lp ** 2 * self.Lr ** 2 * self.mp ** 2 * torch.cos(alpha) ** 2
-            - (4.0 * self.Jp + self.Lp ** 2 * self.mp)
-            * (
-                4.0 * self.Jr
-                + self.Lp ** 2 * self.mp * torch.sin(alpha) ** 2
-                + 4.0 * self.Lr ** 2 * self.mp
-            )
-        )
-
-        # Saturation
-        xnorm = torch.linalg.norm(x, 2, dim=-1)
-        sat = torch.where(xnorm <= self.r, 1.,
-                          torch.where(xnorm < self.r + self.d,
-                                      self.p(xnorm - self.r), 0.))
-        # xbig = torch.argwhere(xnorm > self.r)
-        # if torch.numel(xbig) > 0:
-        #     print(torch.numel(xbig))
+    def f(self, x, action=0.):
+        return qqs2_dynamics(self.params, None, x, action)
 
-        return xdot * torch.unsqueeze(sat, dim=-1)
+    def simulate_rk4(self, x_0: torch.tensor, n_steps: int, dt,
+                     t_0=0.) -> torch.tensor:
+        # Without control input, simulate the pure qqs2_dynamics from
+        # self.params, as simulate_fn can also be used with torch.func
+        if self.u != self.null_controller:
+            return super().simulate_rk4(x_0, n_steps, dt, t_0=t_0)
+        tq = t_0 + dt * torch.arange(n_steps, device=x_0.device)
+        return tq, simulate_fn(self.params, x_0, tq, qqs2_dynamics)
 
     def h(self, x):
         return x[..., :2]
@@ -595,6 +887,67 @@ class QuanserQubeServo2(System):
         xdot[..., 1] = torch.ones_like(x[..., 1])
         return xdot
 
+    # Fast path on CPU for a single trajectory without control input: numba
+    # compiled dynamics and analytic Jacobian integrated by scipy, without
+    # autograd
+    def numba_params(self):
+        # Same constants as self.params for the uncontrolled numba kernels,
+        # as a tuple of floats
+        params = self.params
+        keys = ['Lp2_mp', 'Lp_Lr_mp', 'Jp_eff', 'a_theta_dot', 'b_alpha_dot',
+                'b_sin', 'c0', 'den_cos2', 'r', 'd']
+        return tuple(float(params[k]) for k in keys) + tuple(
+            params['coef'].flatten().tolist())
+
+    def jac(self, t, y):
+        # Jacobian of the uncontrolled dynamics for a single state as a
+        # numpy array, of shape (4, 4)
+        return _qqs2_jac(t, np.asarray(y, dtype=np.float64),
+                         self.numba_params())
+
+    def simulate_numba(self, x_0, tsim, dt, rtol=1e-4, atol=1e-6):
+        """
+        Simulates a single trajectory of the system without control input
+        on CPU: the dynamics and their analytic Jacobian are compiled with
+        numba if it is installed, and integrated by the LSODA solver of
+        scipy. Raises NotImplementedError if a controller is set in self.u.
+
+        Parameters
+        ----------
+        x_0: array-like
+            Initial value for simulation, of shape (dim_x,).
+
+        tsim: tuple
+            Tuple of (Start, End) time of simulation.
+
+        dt: float
+            Time step of the output.
+
+        rtol: float
+            Relative tolerance of the solver.
+
+        atol: float
+            Absolute tolerance of the solver.
+
+        Returns
+        ----------
+        tq: np.ndarray
+            Timesteps of the solution.
+
+        sol: np.ndarray
+            Remapped solution of the simulation, of shape (len(tq), dim_x).
+        """
+        if self.u != self.null_controller:
+            raise NotImplementedError(
+                'simulate_numba only simulates without control input, use '
+                'simulate instead')
+        tq = np.arange(tsim[0], tsim[1], dt)
+        sol = solve_ivp(_qqs2_rhs, (tq[0], tq[-1]),
+                        np.asarray(x_0, dtype=np.float64), t_eval=tq,
+                        method='LSODA', jac=_qqs2_jac,
+                        args=(self.numba_params(),), rtol=rtol, atol=atol)
+        return tq, self.remap(np.ascontiguousarray(sol.y.T))
+
     # For flexibility and coherence: use remap function after every simulation
     # But be prepared to change its behavior!
     def remap(self, traj, wc=False):
@@ -612,17 +965,15 @@ class QuanserQubeServo2(System):
         # Reorder as (theta, alpha, thetadot, alphadot)
         # Convention for alpha: 0 is upwards (depends on dataset!)
         # Remap as simulation data
-        traj_copy = copy.deepcopy(traj)
+        # Works in place on numpy arrays and torch tensors alike: the
+        # permuted columns are gathered at once instead of deep copying traj
+        perm = [1, 0, 3, 2]
         if not wc:
-            traj[..., 0], traj[..., 1] = traj_copy[..., 1], traj_copy[..., 0]
-            traj[..., 2], traj[..., 3] = traj_copy[..., 3], traj_copy[..., 2]
+            traj[...] = traj[..., perm]
             if add_pi_alpha:
                 traj[..., 1] += np.pi
         else:
-            traj[..., 0, :], traj[..., 1, :] = \
-                traj_copy[..., 1, :], traj_copy[..., 0, :]
-            traj[..., 2, :], traj[..., 3, :] = \
-                traj_copy[..., 3, :], traj_copy[..., 2, :]
+            traj[...] = traj[..., perm, :]
             if add_pi_alpha:
                 traj[..., 1, :] += np.pi
         return self.remap(traj, wc=wc)
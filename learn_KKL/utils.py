@@ -142,6 +142,37 @@ def RMSE(x, y, dim=None):
     return torch.sqrt(MSE(x=x, y=y, dim=dim))
 
 
+def interp_linear(points, values, t):
+    """
+    Piecewise linear interpolation of values at times t, extrapolated
+    linearly outside of the time points. If only one value is given, it is
+    kept constant.
+
+    Parameters
+    ----------
+    points: torch.tensor
+        Sorted time points, of shape (N,).
+    values: torch.tensor
+        Values at the time points, of shape (N, dim).
+    t: torch.tensor
+        Times at which to interpolate, of shape (M,).
+
+    Returns
+    -------
+    interpolate_x: torch.tensor
+        Interpolated values, of shape (M, dim).
+    """
+    if len(points) == 1:
+        return values[0].repeat(len(t), 1)
+    # Locate all t in the sorted time points at once, then interpolate
+    # linearly on the segment (duplicate time points: take the first value)
+    idx = torch.searchsorted(points, t).clamp(1, len(points) - 1)
+    t_prev, t_next = points[idx - 1], points[idx]
+    dt = t_next - t_prev
+    w = torch.where(dt > 0, (t - t_prev) / dt, 0.).unsqueeze(-1)
+    return torch.lerp(values[idx - 1], values[idx], w)
+
+
 # Replaces sklearn StandardScaler()
 # https://discuss.pytorch.org/t/pytorch-tensor-scaling/38576
 class StandardScaler:
@@ -7,9 +7,11 @@ setup(
     url='https://github.com/Centre-automatique-et-systemes/learn_observe_KKL.git',
     author='Lukas Bahr',
     packages=['learn_KKL'],
-    install_requires=['numpy', 'torch', 'scipy', 'matplotlib==3.5.1',
-                      'torchdiffeq', 'smt', 'jupyter', 'tensorboard',
-                      'seaborn', 'pytorch-lightning', 'dill', 'functorch'],
+    install_requires=['numpy', 'torch>=2.1', 'scipy', 'matplotlib==3.5.1',
+                      'torchdiffeq>=0.2.4', 'smt', 'jupyter', 'tensorboard',
+                      'seaborn', 'pytorch-lightning', 'dill'],
+    # Optional faster simulation backends
+    extras_require={'fast': ['numba', 'torchode>=0.1.6']},
     version='0.1.0',
     license='MIT',
     description='Implementation of the paper: "Towards gain tuning for '